@@ -319,6 +319,9 @@ def prepare_mask(mask: Image.Image):
     Returns:
         Image: The luminance mask.
     """
+    # frontend sends the mask's alpha channel as grayscale already
+    if mask.mode == "L":
+        return mask
     return mask.getchannel("A")
 
 
@@ -178,6 +178,7 @@ class Defaults:
     just_use_yaml: bool = False
     create_mask_layer: bool = True
     save_temp_images: bool = False
+    fast_upload_png: bool = False
     fix_aspect_ratio: bool = True
     only_full_img_tiling: bool = True
     filter_nsfw: bool = False
@@ -36,6 +36,9 @@ class ConfigPage(QWidget):
         self.save_temp_images = QCheckBox(
             script.cfg, "save_temp_images", "Save images for debug"
         )
+        self.fast_upload_png = QCheckBox(
+            script.cfg, "fast_upload_png", "Fast upload encoding (larger PNGs)"
+        )
         self.fix_aspect_ratio = QCheckBox(
             script.cfg, "fix_aspect_ratio", "Adjust selection aspect ratio"
         )
@@ -90,6 +93,7 @@ class ConfigPage(QWidget):
         layout_inner.addWidget(self.only_full_img_tiling)
         layout_inner.addWidget(self.include_grid)
         layout_inner.addWidget(self.save_temp_images)
+        layout_inner.addWidget(self.fast_upload_png)
         # layout_inner.addWidget(self.just_use_yaml)
 
         layout_inner.addWidget(QLabel("<em>Backend/webUI settings:</em>"))
@@ -125,6 +129,7 @@ class ConfigPage(QWidget):
         self.just_use_yaml.cfg_init()
         self.create_mask_layer.cfg_init()
         self.save_temp_images.cfg_init()
+        self.fast_upload_png.cfg_init()
         self.fix_aspect_ratio.cfg_init()
         self.only_full_img_tiling.cfg_init()
         self.include_grid.cfg_init()
@@ -161,6 +166,7 @@ class ConfigPage(QWidget):
         self.just_use_yaml.cfg_connect()
         self.create_mask_layer.cfg_connect()
         self.save_temp_images.cfg_connect()
+        self.fast_upload_png.cfg_connect()
         self.fix_aspect_ratio.cfg_connect()
         self.only_full_img_tiling.cfg_connect()
         self.include_grid.cfg_connect()
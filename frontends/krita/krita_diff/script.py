@@ -1,6 +1,8 @@
 import itertools
+import logging
 import os
 import time
+from functools import partial
 from typing import Union
 
 from krita import (
@@ -13,7 +15,9 @@ from krita import (
     QObject,
     QPixmap,
     QRect,
+    QRunnable,
     Qt,
+    QThreadPool,
     QTimer,
     Selection,
     pyqtSignal
@@ -35,9 +39,38 @@ from .utils import (
     find_optimal_selection_region,
     get_desc_from_resp,
     img_to_ba,
-    save_img,
+    img_to_png,
+    resize_img,
+    save_png,
 )
 
+# per-image debug output is noisy & runs on the hot insertion path, so only logged at debug level
+logger = logging.getLogger(__name__)
+
+
+class AsyncTaskSignals(QObject):
+    result = pyqtSignal(object)
+    error = pyqtSignal(Exception)
+
+
+# QRunnable isn't a QObject, so signals are held by a separate object
+class AsyncTask(QRunnable):
+    def __init__(self, fn, *args):
+        """Run `fn(*args)` in a QThreadPool, emitting `signals.result` or `signals.error`.
+
+        `fn` must not touch Krita's API, since it runs outside the GUI thread.
+        """
+        super(AsyncTask, self).__init__()
+        self.fn = fn
+        self.args = args
+        self.signals = AsyncTaskSignals()
+
+    def run(self):
+        try:
+            self.signals.result.emit(self.fn(*self.args))
+        except Exception as e:
+            self.signals.error.emit(e)
+
 
 # Does it actually have to be a QObject?
 # The only possible use I see is for event emitting
@@ -84,6 +117,16 @@ class Script(QObject):
         self.progress_update.connect(lambda p: self.update_status_bar_eta(p))
         # keep track of inserted layers to prevent accidental usage as inpaint mask
         self._inserted_layers = []
+        # actions sharing the same prologue are built once, see make_action()
+        self.action_txt2img = self.make_action(self.apply_txt2img)
+        self.action_img2img = self.make_action(partial(self.apply_img2img, False))
+        self.action_inpaint = self.make_action(partial(self.apply_img2img, True))
+        self.action_simple_upscale = self.make_action(
+            self.apply_simple_upscale, adjust=False
+        )
+        self.action_preview_controlnet_annotator = self.make_action(
+            self.apply_controlnet_preview_annotator
+        )
 
     def restore_defaults(self, if_empty=False):
         """Restore to default config."""
@@ -135,6 +178,8 @@ class Script(QObject):
             self.width = self.selection.width()
             self.height = self.selection.height()
 
+        # NOTE: img_inserter relies on U8/RGBA (4 bytes per pixel) to compute the
+        # expected setPixelData() size without reading pixels back from Krita
         assert (
             self.doc.colorDepth() == "U8"
         ), f'Only "8-bit integer/channel" supported, Document Color Depth: {self.doc.colorDepth()}'
@@ -163,14 +208,16 @@ class Script(QObject):
 
     def get_selection_image(self) -> QImage:
         """QImage of selection"""
+        # Krita's U8/RGBA pixelData is BGRA in memory, which is exactly what
+        # QImage.Format_ARGB32 is on little-endian, so no rgbSwapped() copy is needed
         return QImage(
             self.doc.pixelData(self.x, self.y, self.width, self.height),
             self.width,
             self.height,
-            QImage.Format_RGBA8888,
-        ).rgbSwapped()
+            QImage.Format_ARGB32,
+        )
 
-    def get_mask_image(self, using_official_api) -> Union[QImage, None]:
+    def get_mask_image(self) -> Union[QImage, None]:
         """QImage of mask layer for inpainting"""
         if self.node.type() not in {"paintlayer", "filelayer"}:
             assert False, "Please select a valid layer to use as inpaint mask!"
@@ -181,21 +228,19 @@ class Script(QObject):
             self.node.pixelData(self.x, self.y, self.width, self.height),
             self.width,
             self.height,
-            QImage.Format_RGBA8888,
+            QImage.Format_ARGB32,
         )
 
-        if using_official_api:
-            # Official API requires a black and white mask.
-            # Fastest way to do this: Convert to 1 channel alpha, tell it that
-            # it's grayscale, convert that to RGBA.
-            mask = mask.convertToFormat(QImage.Format_Alpha8)
-            mask.reinterpretAsFormat(QImage.Format_Grayscale8)
-            mask = mask.convertToFormat(QImage.Format_RGBA8888)
+        # Only the alpha channel is used as mask (the official API wants black & white).
+        # Fastest way to do this: Convert to 1 channel alpha, tell it that it's grayscale.
+        # A 1 channel PNG is also a quarter of the raw size & compresses much better.
+        mask = mask.convertToFormat(QImage.Format_Alpha8)
+        mask.reinterpretAsFormat(QImage.Format_Grayscale8)
 
-        return mask.rgbSwapped()
+        return mask
 
     def img_inserter(self, x, y, width, height, inpaint=False, glayer=None):
-        """Return frozen image inserter to insert images as new layer."""
+        """Return frozen image inserter to insert images as new layers."""
         # Selection may change before callback, so freeze selection region
         has_selection = self.selection is not None
 
@@ -208,62 +253,145 @@ class Script(QObject):
             else:
                 parent.addChildNode(layer, None)
             return layer
-            
-        def insert(layer_name, enc):
-            nonlocal x, y, width, height, has_selection
-            print(f"inserting layer {layer_name}")
-            print(f"data size: {len(enc)}")
+
+        # Decoding runs in thread pool, so must not touch Krita.
+        # Whether scaling is possible is known now, so pick the decoder once instead of per image.
+        def decode(enc):
+            """Decode image to raw pixel data."""
+            logger.debug("data size: %d", len(enc))
 
             # QImage.Format_RGB32 (4) is default format after decoding image
             # QImage.Format_RGBA8888 (17) is format used in Krita tutorial
             # both are compatible, & converting from 4 to 17 required a RGB swap
             # Likewise for 5 & 18 (their RGBA counterparts)
             image = b64_to_img(enc)
-            print(
-                f"image created: {image}, {image.width()}x{image.height()}, depth: {image.depth()}, format: {image.format()}"
+            logger.debug(
+                "image created: %dx%d, depth: %d, format: %s",
+                image.width(),
+                image.height(),
+                image.depth(),
+                image.format(),
             )
-
-            # NOTE: Scaling must be done by the frontend when using the official API.
-            # The scaling here is for SD Upscale, Upscale on a selection region, or inpainting.
-            # Image won't be scaled down ONLY if there is no selection; i.e. selecting whole image will scale down,
-            # not selecting anything won't scale down, leading to the canvas being resized afterwards
-            if (has_selection or inpaint) and (image.width() != width or image.height() != height):
-                print(f"Rescaling image to selection: {width}x{height}")
-                image = image.scaled(
-                    width, height, transformMode=Qt.SmoothTransformation
+            return image
+
+        def decode_plain(enc, target_width, target_height):
+            """Decode image to raw pixel data without scaling."""
+            image = decode(enc)
+            return img_to_ba(image), image.width(), image.height()
+
+        def decode_scaled(enc, target_width, target_height):
+            """Decode image to raw pixel data, scaled to the selection."""
+            image = decode(enc)
+            if image.width() != target_width or image.height() != target_height:
+                logger.debug(
+                    "Rescaling image to selection: %dx%d", target_width, target_height
                 )
+                image = resize_img(image, target_width, target_height)
+            return img_to_ba(image), target_width, target_height
+
+        # NOTE: Scaling must be done by the frontend when using the official API.
+        # The scaling here is for SD Upscale, Upscale on a selection region, or inpainting.
+        # Image won't be scaled down ONLY if there is no selection; i.e. selecting whole image will scale down,
+        # not selecting anything won't scale down, leading to the canvas being resized afterwards
+        decode_raw = decode_scaled if has_selection or inpaint else decode_plain
+
+        def insert(layer_name, decoded):
+            nonlocal x, y, width, height
+            logger.debug("inserting layer %s", layer_name)
+            ba, img_width, img_height = decoded
 
             # Resize (not scale!) canvas if image is larger (i.e. outpainting or Upscale was used)
-            if image.width() > self.doc.width() or image.height() > self.doc.height():
+            if img_width > self.doc.width() or img_height > self.doc.height():
                 # NOTE:
                 # - user's selection will be partially ignored if image is larger than canvas
                 # - it is complex to scale/resize the image such that image fits in the newly scaled selection
                 # - the canvas will still be resized even if the image fits after transparency masking
                 print("Image is larger than canvas! Resizing...")
                 new_width, new_height = self.doc.width(), self.doc.height()
-                if image.width() > self.doc.width():
-                    x, width, new_width = 0, image.width(), image.width()
-                if image.height() > self.doc.height():
-                    y, height, new_height = 0, image.height(), image.height()
+                if img_width > self.doc.width():
+                    x, width, new_width = 0, img_width, img_width
+                if img_height > self.doc.height():
+                    y, height, new_height = 0, img_height, img_height
                 self.doc.resizeImage(0, 0, new_width, new_height)
 
-            ba = img_to_ba(image)
             layer = create_layer(layer_name)
             # layer.setColorSpace() doesn't pernamently convert layer depth etc...
 
             # Don't fail silently for setPixelData(); fails if bit depth or number of channels mismatch
             size = ba.size()
-            expected = layer.pixelData(x, y, width, height).size()
+            # U8/RGBA is asserted in update_selection(), so each pixel is 4 bytes
+            expected = width * height * 4
             assert expected == size, f"Raw data size: {size}, Expected size: {expected}"
 
-            print(f"inserting at x: {x}, y: {y}, w: {width}, h: {height}")
+            logger.debug("inserting at x: %d, y: %d, w: %d, h: %d", x, y, width, height)
             layer.setPixelData(ba, x, y, width, height)
             self._inserted_layers.append(layer)
 
             return layer
 
-        return insert
-    
+        def insert_all(outputs: list, cb):
+            """Decode (name, enc) outputs in the thread pool, then insert them in order.
+
+            `cb` is called on the GUI thread with the inserted layers once all are inserted.
+            """
+            layers = []
+            decoded = {}
+            # NOTE: need to keep reference to tasks until their signals are delivered
+            tasks = []
+            failed = False
+
+            def stop():
+                """Stop inserting the rest of the batch after an error."""
+                nonlocal failed
+                failed = True
+                decoded.clear()
+                QTimer.singleShot(0, tasks.clear)
+
+            def handle_decoded(i, result):
+                if failed:
+                    return
+                decoded[i] = result
+                # insert in order so layer stacking matches output order
+                while len(layers) in decoded:
+                    idx = len(layers)
+                    try:
+                        layers.append(insert(outputs[idx][0], decoded.pop(idx)))
+                    except Exception:
+                        stop()
+                        raise
+                if len(layers) == len(outputs):
+                    # defer release, as the emitting task is still in use
+                    QTimer.singleShot(0, tasks.clear)
+                    cb(layers)
+
+            def handle_error(e):
+                if failed:
+                    return
+                stop()
+                raise e
+
+            if len(outputs) < 1:
+                cb(layers)
+                return
+
+            # insert() may grow width/height on the GUI thread, so workers get a frozen copy
+            target_width, target_height = width, height
+            pool = QThreadPool.globalInstance()
+            for i, (_, enc) in enumerate(outputs):
+                task = AsyncTask(decode_raw, enc, target_width, target_height)
+                task.signals.result.connect(
+                    lambda res, i=i: handle_decoded(i, res), Qt.QueuedConnection
+                )
+                task.signals.error.connect(handle_error, Qt.QueuedConnection)
+                tasks.append(task)
+                pool.start(task)
+
+        return insert_all
+
+    def save_png_async(self, png, path: str):
+        """Save already PNG-encoded temp image in thread pool."""
+        QThreadPool.globalInstance().start(AsyncTask(save_png, png, path))
+
     def check_controlnet_enabled(self):
         for i in range(len(self.cfg("controlnet_unit_list", "QStringList"))):
             if self.cfg(f"controlnet{i}_enable", bool):
@@ -274,9 +402,9 @@ class Script(QObject):
 
         for i in range(len(self.cfg("controlnet_unit_list", "QStringList"))):    
             if self.cfg(f"controlnet{i}_enable", bool):
-                input_image = b64_to_img(self.cfg(f"controlnet{i}_input_image", str)) if \
-                    self.cfg(f"controlnet{i}_input_image", str) else selected
-                    
+                enc = self.cfg(f"controlnet{i}_input_image", str)
+                input_image = b64_to_img(enc) if enc else selected
+
                 input_images.update({f"{i}": input_image})
 
         return input_images
@@ -298,17 +426,23 @@ class Script(QObject):
             #response key varies for official api used for controlnet
             outputs = response["outputs"] if not controlnet_enabled else response["images"]
             glayer_name, layer_names = get_desc_from_resp(response, "txt2img")
-            layers = [
-                insert(name if name else f"txt2img {i + 1}", output)
-                for output, name, i in zip(outputs, layer_names, itertools.count())
-            ]
-            if self.cfg("hide_layers", bool):
-                for layer in layers[:-1]:
-                    layer.setVisible(False)
-            if glayer:
-                glayer.setName(glayer_name)
-            self.doc.refreshProjection()
-            mask_trigger(layers)
+
+            def cb_inserted(layers):
+                if self.cfg("hide_layers", bool):
+                    for layer in layers[:-1]:
+                        layer.setVisible(False)
+                if glayer:
+                    glayer.setName(glayer_name)
+                self.doc.refreshProjection()
+                mask_trigger(layers)
+
+            insert(
+                [
+                    (name if name else f"txt2img {i + 1}", output)
+                    for output, name, i in zip(outputs, layer_names, itertools.count())
+                ],
+                cb_inserted,
+            )
 
         self.eta_timer.start(ETA_REFRESH_INTERVAL)
 
@@ -327,28 +461,32 @@ class Script(QObject):
         controlnet_enabled = self.check_controlnet_enabled()
 
         mask_trigger = self.transparency_mask_inserter()
-        mask_image = self.get_mask_image(controlnet_enabled) if is_inpaint else None
+        mask_image = self.get_mask_image() if is_inpaint else None
         glayer = self.doc.createGroupLayer("Unnamed Group")
         self.doc.rootNode().addChildNode(glayer, None)
         insert = self.img_inserter(
             self.x, self.y, self.width, self.height, is_inpaint, glayer
         )
 
-        path = os.path.join(self.cfg("sample_path", str), f"{int(time.time())}.png")
-        mask_path = os.path.join(
-            self.cfg("sample_path", str), f"{int(time.time())}_mask.png"
-        )
+        save_temp = self.cfg("save_temp_images", bool)
+        if save_temp:
+            # same timestamp for both so the image & its mask are paired
+            path_prefix = os.path.join(self.cfg("sample_path", str), str(int(time.time())))
+
+        # encode once; same PNG is sent to backend & saved as temp image
+        fast_png = self.cfg("fast_upload_png", bool)
+        mask_png = img_to_png(mask_image, fast_png) if mask_image is not None else None
         if is_inpaint and mask_image is not None:
-            if self.cfg("save_temp_images", bool):
-                save_img(mask_image, mask_path)
+            if save_temp:
+                self.save_png_async(mask_png, f"{path_prefix}_mask.png")
             # auto-hide mask layer before getting selection image
             self.node.setVisible(False)
             self.controlnet_transparency_mask_inserter(glayer, mask_image)
             self.doc.refreshProjection()
 
-        sel_image = self.get_selection_image()
-        if self.cfg("save_temp_images", bool):
-            save_img(sel_image, path)
+        sel_png = img_to_png(self.get_selection_image(), fast_png)
+        if save_temp:
+            self.save_png_async(sel_png, f"{path_prefix}.png")
 
         def cb(response):
             def cb_upscale(upscale_response):
@@ -359,16 +497,22 @@ class Script(QObject):
                 outputs = upscale_response["images"]
                 layer_name_prefix = "inpaint" if is_inpaint else "img2img"
                 glayer_name, layer_names = get_desc_from_resp(response, layer_name_prefix)
-                layers = [
-                    insert(name if name else f"{layer_name_prefix} {i + 1}", output)
-                    for output, name, i in zip(outputs, layer_names, itertools.count())
-                ]
-                if self.cfg("hide_layers", bool):
-                    for layer in layers[:-1]:
-                        layer.setVisible(False)
-                if glayer:
-                    glayer.setName(glayer_name)
-                self.doc.refreshProjection()
+
+                def cb_inserted(layers):
+                    if self.cfg("hide_layers", bool):
+                        for layer in layers[:-1]:
+                            layer.setVisible(False)
+                    if glayer:
+                        glayer.setName(glayer_name)
+                    self.doc.refreshProjection()
+
+                insert(
+                    [
+                        (name if name else f"{layer_name_prefix} {i + 1}", output)
+                        for output, name, i in zip(outputs, layer_names, itertools.count())
+                    ],
+                    cb_inserted,
+                )
 
             if len(self.client.long_reqs) == 1:  # last request
                 self.eta_timer.stop()
@@ -389,36 +533,42 @@ class Script(QObject):
 
             layer_name_prefix = "inpaint" if is_inpaint else "img2img"
             glayer_name, layer_names = get_desc_from_resp(response, layer_name_prefix)
-            layers = [
-                insert(name if name else f"{layer_name_prefix} {i + 1}", output)
-                for output, name, i in zip(outputs, layer_names, itertools.count())
-            ]
-            if self.cfg("hide_layers", bool):
-                for layer in layers[:-1]:
-                    layer.setVisible(False)
-            if glayer:
-                glayer.setName(glayer_name)
-            self.doc.refreshProjection()
-            # dont need transparency mask for inpaint mode
-            if not is_inpaint:
-                mask_trigger(layers)
+
+            def cb_inserted(layers):
+                if self.cfg("hide_layers", bool):
+                    for layer in layers[:-1]:
+                        layer.setVisible(False)
+                if glayer:
+                    glayer.setName(glayer_name)
+                self.doc.refreshProjection()
+                # dont need transparency mask for inpaint mode
+                if not is_inpaint:
+                    mask_trigger(layers)
+
+            insert(
+                [
+                    (name if name else f"{layer_name_prefix} {i + 1}", output)
+                    for output, name, i in zip(outputs, layer_names, itertools.count())
+                ],
+                cb_inserted,
+            )
 
         self.eta_timer.start()
         if controlnet_enabled:
             if is_inpaint:
                 self.client.post_official_api_inpaint(
-                    cb, sel_image, mask_image, self.width, self.height, self.selection is not None,
-                    self.get_controlnet_input_images(sel_image))
+                    cb, sel_png, mask_png, self.width, self.height, self.selection is not None,
+                    self.get_controlnet_input_images(sel_png))
             else:
                 self.client.post_official_api_img2img(
-                    cb, sel_image, self.width, self.height, self.selection is not None,
-                    self.get_controlnet_input_images(sel_image))
+                    cb, sel_png, self.width, self.height, self.selection is not None,
+                    self.get_controlnet_input_images(sel_png))
         else:
             method = self.client.post_inpaint if is_inpaint else self.client.post_img2img
             method(
                 cb,
-                sel_image,
-                mask_image,  # is unused by backend in img2img mode
+                sel_png,
+                mask_png,  # is unused by backend in img2img mode
                 self.selection is not None,
             )
     
@@ -439,8 +589,8 @@ class Script(QObject):
             sw = self.doc.width()
             sh = self.doc.height()
 
-        # must convert mask to single channel format
-        gray_mask = mask_image.convertToFormat(QImage.Format_Grayscale8)
+        # get_mask_image() already gives the single channel (Grayscale8) mask needed
+        gray_mask = mask_image
         
         mw = gray_mask.width()
         mh = gray_mask.height()
@@ -486,19 +636,20 @@ class Script(QObject):
 
     def apply_simple_upscale(self):
         insert = self.img_inserter(self.x, self.y, self.width, self.height)
-        sel_image = self.get_selection_image()
+        sel_png = img_to_png(
+            self.get_selection_image(), self.cfg("fast_upload_png", bool)
+        )
 
-        path = os.path.join(self.cfg("sample_path", str), f"{int(time.time())}.png")
         if self.cfg("save_temp_images", bool):
-            save_img(sel_image, path)
+            path = os.path.join(self.cfg("sample_path", str), f"{int(time.time())}.png")
+            self.save_png_async(sel_png, path)
 
         def cb(response):
             assert response is not None, "Backend Error, check terminal"
             output = response["output"]
-            insert(f"upscale", output)
-            self.doc.refreshProjection()
+            insert([(f"upscale", output)], lambda _: self.doc.refreshProjection())
 
-        self.client.post_upscale(cb, sel_image)
+        self.client.post_upscale(cb, sel_png)
 
     def transparency_mask_inserter(self):
         """Mask out extra regions due to adjust_selection()."""
@@ -511,6 +662,8 @@ class Script(QObject):
         # This function is recursive to workaround race conditions when calling Krita's actions
         def add_mask(layers: list, cur_selection):
             if len(layers) < 1:
+                # let the queued mask actions finish before swapping the selection back
+                self.doc.waitForDone()
                 self.doc.setSelection(cur_selection)  # reset to current selection
                 return
             layer = layers.pop()
@@ -555,21 +708,22 @@ class Script(QObject):
         return trigger_mask_adding
 
     # Actions
-    def action_txt2img(self):
-        self.status_changed.emit(STATE_WAIT)
-        self.update_selection()
-        if not self.doc:
-            return
-        self.adjust_selection()
-        self.apply_txt2img()
+    def make_action(self, apply, adjust=True):
+        """Return action that runs the common prologue (status, selection) before `apply()`."""
+        status_changed = self.status_changed
+        update_selection = self.update_selection
+        adjust_selection = self.adjust_selection
+
+        def action():
+            status_changed.emit(STATE_WAIT)
+            update_selection()
+            if not self.doc:
+                return
+            if adjust:
+                adjust_selection()
+            apply()
 
-    def action_img2img(self):
-        self.status_changed.emit(STATE_WAIT)
-        self.update_selection()
-        if not self.doc:
-            return
-        self.adjust_selection()
-        self.apply_img2img(False)
+        return action
 
     def action_sd_upscale(self):
         assert False, "disabled"
@@ -577,50 +731,14 @@ class Script(QObject):
         self.update_selection()
         self.apply_img2img(mode=2)
 
-    def action_inpaint(self):
-        self.status_changed.emit(STATE_WAIT)
-        self.update_selection()
-        if not self.doc:
-            return
-        self.adjust_selection()
-        self.apply_img2img(True)
-
-    def action_simple_upscale(self):
-        self.status_changed.emit(STATE_WAIT)
-        self.update_selection()
-        if not self.doc:
-            return
-        self.apply_simple_upscale()
-
     def action_update_config(self):
         """Update certain config/state from the backend."""
         self.client.get_config()
-            
-    def action_update_controlnet_config(self):
-        """Update controlnet config from the backend."""
-        self.client.get_controlnet_config()
-
-    def action_preview_controlnet_annotator(self):
-        self.status_changed.emit(STATE_WAIT)
-        self.update_selection()
-        if not self.doc:
-            return
-        self.adjust_selection()
-        self.apply_controlnet_preview_annotator()
 
-            
     def action_update_controlnet_config(self):
         """Update controlnet config from the backend."""
         self.client.get_controlnet_config()
 
-    def action_preview_controlnet_annotator(self):
-        self.status_changed.emit(STATE_WAIT)
-        self.update_selection()
-        if not self.doc:
-            return
-        self.adjust_selection()
-        self.apply_controlnet_preview_annotator()
-
     def action_interrupt(self):
         def cb(resp=None):
             self.status_changed.emit(STATE_INTERRUPT)
@@ -2,8 +2,29 @@ import json
 import re
 from itertools import cycle
 from math import ceil
+from typing import Union
 
-from krita import Krita, QBuffer, QByteArray, QImage, QIODevice, Qt
+from krita import Krita, QBuffer, QByteArray, QImage, QImageWriter, QIODevice, Qt
+
+# pybase64 (SIMD base64) is not bundled with Krita, so fallback to Qt's decoder
+try:
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+# Likewise, Pillow (Lanczos, SIMD if Pillow-SIMD) is optional for resizing
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Numba is optional too; without it, njit-decorated functions run as plain Python
+try:
+    from numba import njit
+except ImportError:
+
+    def njit(*args, **kwargs):
+        return lambda fn: fn
 
 from .config import Config
 from .defaults import (
@@ -130,6 +151,33 @@ def find_optimal_selection_region(
     # w * (h/w - h/w) = h
     ypad_limit = ceil(abs(1 / fix_ratio - 1 / orig_ratio) * orig_width) * 2
 
+    return search_selection_padding(
+        float(fix_ratio),
+        int(orig_x),
+        int(orig_y),
+        int(orig_width),
+        int(orig_height),
+        int(canvas_width),
+        int(canvas_height),
+        int(xpad_limit),
+        int(ypad_limit),
+    )
+
+
+@njit(cache=True)
+def search_selection_padding(
+    fix_ratio: float,
+    orig_x: int,
+    orig_y: int,
+    orig_width: int,
+    orig_height: int,
+    canvas_width: int,
+    canvas_height: int,
+    xpad_limit: int,
+    ypad_limit: int,
+):
+    """Inner loop of `find_optimal_selection_region()`, compiled by Numba if available."""
+    orig_ratio = orig_width / orig_height
     best_x = orig_x
     best_y = orig_y
     best_width = orig_width
@@ -158,36 +206,78 @@ def find_optimal_selection_region(
     return best_x, best_y, best_width, best_height
 
 
-def save_img(img: QImage, path: str):
-    """Expects QImage"""
-    # png is lossless; setting compression to max (0) won't affect quality
-    # NOTE: save_img WILL FAIL when using remote backend
+def save_png(png: QByteArray, path: str):
+    """Writes already PNG-encoded QByteArray (see `img_to_png()`) to path."""
+    # NOTE: save_png WILL FAIL when using remote backend
     try:
-        img.save(path, "PNG", 0)
+        with open(path, "wb") as f:
+            f.write(png.data())
     except:
         pass
 
 
+def resize_img(img: QImage, width: int, height: int):
+    """Scales QImage to width & height, using Pillow's Lanczos filter if available."""
+    if Image is None:
+        return img.scaled(width, height, transformMode=Qt.SmoothTransformation)
+
+    # Format_ARGB32 is packed BGRA on little-endian, which Pillow can read directly
+    img = img.convertToFormat(QImage.Format_ARGB32)
+    ptr = img.constBits()
+    ptr.setsize(img.sizeInBytes())
+    # read through a memoryview instead of asstring() to skip copying the source pixels
+    pil_img = Image.frombuffer(
+        "RGBA",
+        (img.width(), img.height()),
+        memoryview(ptr),
+        "raw",
+        "BGRA",
+        img.bytesPerLine(),
+        1,
+    )
+    data = pil_img.resize((width, height), Image.LANCZOS).tobytes("raw", "BGRA")
+    # copy() so the QImage owns its buffer instead of referencing data
+    return QImage(data, width, height, width * 4, QImage.Format_ARGB32).copy()
+
+
 def img_to_ba(img: QImage):
     """Converts QImage to QByteArray"""
-    ptr = img.bits()
-    ptr.setsize(img.byteCount())
+    # constBits() unlike bits() doesn't detach (deep copy) a shared QImage
+    ptr = img.constBits()
+    ptr.setsize(img.sizeInBytes())
     return QByteArray(ptr.asstring())
 
 
-def img_to_b64(img: QImage):
-    """Converts QImage to base64-encoded string"""
+def img_to_png(img: QImage, fast: bool = False):
+    """Converts QImage to PNG-encoded QByteArray
+
+    Args:
+        img (QImage): Image to encode.
+        fast (bool, optional): Use fastest zlib compression instead of max. Defaults to False.
+    """
     ba = QByteArray()
     buffer = QBuffer(ba)
     buffer.open(QIODevice.WriteOnly)
-    img.save(buffer, "PNG", 0)
+    writer = QImageWriter(buffer, b"PNG")
+    # png is lossless; Qt maps quality 0 to zlib level 9 & quality 80 to zlib level 1
+    writer.setQuality(80 if fast else 0)
+    writer.write(img)
+    return ba
+
+
+def img_to_b64(img: Union[QImage, QByteArray]):
+    """Converts QImage (or PNG-encoded QByteArray from `img_to_png()`) to base64-encoded string"""
+    ba = img if isinstance(img, QByteArray) else img_to_png(img)
     return ba.toBase64().data().decode("utf-8")
 
 
 def b64_to_img(enc: str):
     """Converts base64-encoded string to QImage"""
-    ba = QByteArray.fromBase64(enc.encode("utf-8"))
-    return QImage.fromData(ba) #Removed explicit format to support other image formats.
+    if pybase64 is not None:
+        data = pybase64.b64decode(enc, validate=False)
+    else:
+        data = QByteArray.fromBase64(enc.encode("utf-8"))
+    return QImage.fromData(data) #Removed explicit format to support other image formats.
 
 
 def bytewise_xor(msg: bytes, key: bytes):